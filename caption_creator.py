@@ -14,7 +14,11 @@ from custom_logger import logger_config
 from typing import List, Dict, Tuple, Optional
 import random
 import os
-from PIL import Image, ImageDraw, ImageFont
+import json
+import hashlib
+import contextlib
+import time
+from PIL import Image
 import common
 
 # Monkeypatch for Pillow 10+ which removed ANTIALIAS
@@ -26,6 +30,39 @@ from config import Config
 import constants
 import subprocess
 from aspect_validator import AspectRatioValidator
+from caption_renderer import CaptionRenderer, alpha_blit, render_groups, trim_to_content
+
+# CAPTO_PROFILE=1 logs wall time per pipeline phase after each video
+_PROFILE = os.environ.get("CAPTO_PROFILE") == "1"
+_phase_totals: Dict[str, List[float]] = {}
+
+@contextlib.contextmanager
+def _phase(name: str):
+	if not _PROFILE:
+		yield
+		return
+
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		totals = _phase_totals.setdefault(name, [0, 0.0])
+		totals[0] += 1
+		totals[1] += time.perf_counter() - start
+
+def _log_phases() -> None:
+	if not _PROFILE or not _phase_totals:
+		return
+
+	report = {
+		name: (int(calls), round(total, 3), round(total / calls * 1000, 2))
+		for name, (calls, total) in _phase_totals.items()
+	}
+	logger_config.info(f"Phase timings {{phase: (calls, total_s, mean_ms)}}: {report}")
+	_phase_totals.clear()
+
+# Punctuation stripped from both ends of a spoken word before it is displayed
+_STRIP_CHARS = '.,!?;:"'
 
 class CaptionCreator:
 	def __init__(self, video_path: str = None, config: Optional[Config] = None):
@@ -36,12 +73,28 @@ class CaptionCreator:
 		self.cfr_video_path = None
 		self.needs_cleanup = False
 		self.needs_crop = False
-		chosen_font = random.choice(self.config.font_path)
-		self.font_path = os.path.abspath(chosen_font)
-		logger_config.info(f"Using font: {os.path.basename(self.font_path)}")
+		self.font_path = None
+		self._select_font(video_path)
 		self.word_timestamps = self.config.word_timestamps
 		self.fps = None
 
+	def _select_font(self, video_path: Optional[str] = None) -> None:
+		"""
+		Pick a font from the palette. With deterministic_font the choice is a hash of
+		the video path, so re-rendering the same video keeps its font (and caches stay valid).
+		"""
+		if self.config.deterministic_font and video_path:
+			digest = hashlib.blake2b(os.path.abspath(video_path).encode(), digest_size=4).hexdigest()
+			chosen_font = self.config.font_path[int(digest, 16) % len(self.config.font_path)]
+		else:
+			chosen_font = random.choice(self.config.font_path)
+
+		font_path = os.path.abspath(chosen_font)
+		if font_path != self.font_path:
+			self.font_path = font_path
+			logger_config.info(f"Using font: {os.path.basename(self.font_path)}")
+			self._renderer = CaptionRenderer(self.font_path, self.config)
+
 	def _setup_required_folder(self):
 		utils.create_directory(constants.INPUT_FOLDER)
 		utils.create_directory(constants.OUTPUT_FOLDER)
@@ -51,6 +104,8 @@ class CaptionCreator:
 	def set_video(self, video_path):
 		if video_path:
 			self.video_path = os.path.abspath(video_path)
+			if self.config.deterministic_font:
+				self._select_font(self.video_path)
 
 			if self.config.keep_original_aspect:
 				logger_config.info("Skipping aspect ratio validation (keep original aspect).")
@@ -154,7 +209,18 @@ class CaptionCreator:
 				self.cfr_video_path = None
 				self.needs_cleanup = False
 
-			self.video = VideoFileClip(video_to_load)
+			# ffmpeg scales while decoding, and skipping audio avoids a second reader
+			# process; the source audio is muxed back in after rendering
+			target_resolution = None
+			if self.config.target_resolution:
+				target_width, target_height = self.config.target_resolution
+				target_resolution = (target_height, target_width)
+
+			self.video = VideoFileClip(
+				video_to_load,
+				target_resolution=target_resolution,
+				audio=self.config.need_audio
+			)
 			original_size = self.video.size
 			
 			logger_config.info(f"Original video: {original_size[0]}x{original_size[1]}")
@@ -189,170 +255,127 @@ class CaptionCreator:
 					)
 
 			if not self.word_timestamps:
-				with FasterWhispherSTTProcessor() as STT:
-					self.word_timestamps = STT.transcribe({
-						"model": "fasterwhispher", 
-						"input": self.video_path
-					})["segments"]["word"]
+				with _phase("stt"):
+					self.word_timestamps = self._transcribe()
 			
 			logger_config.info(f"Video loaded: {self.video.duration:.2f}s @ {self.fps} fps")
 			logger_config.info(f"Final size: {self.video.size[0]}x{self.video.size[1]}")
 			logger_config.info(f"Total words: {len(self.word_timestamps)}")
+
+			self._cleaned = [self._clean_word(word_data["word"]) for word_data in self.word_timestamps]
+			self._prepare_word_timings()
+			self._prepare_renderer()
 			
 		except Exception as e:
 			raise ValueError(f"Failed to load video: {str(e)}")
 
+	def _transcribe(self, model: str = "fasterwhispher") -> List[Dict]:
+		"""Run STT on the input video, reusing a cached transcription of the same file."""
+		cache_path = None
+		if self.config.use_stt_cache:
+			cache_key = utils.get_file_hash(self.video_path)
+			cache_path = os.path.join(
+				os.path.expanduser(constants.STT_CACHE_FOLDER), f"{cache_key}_{model}.json"
+			)
+			if os.path.exists(cache_path):
+				try:
+					with open(cache_path, "r") as f:
+						word_timestamps = json.load(f)
+					logger_config.info(f"Loaded cached transcription: {cache_path}")
+					return word_timestamps
+				except Exception as e:
+					logger_config.warning(f"Ignoring unreadable STT cache {cache_path}: {e}")
+
+		with FasterWhispherSTTProcessor() as STT:
+			word_timestamps = STT.transcribe({
+				"model": model,
+				"input": self.video_path
+			})["segments"]["word"]
+
+		if cache_path:
+			utils.write_json_atomic(cache_path, word_timestamps)
+			logger_config.debug(f"Cached transcription: {cache_path}")
+
+		return word_timestamps
+
+	def _prepare_renderer(self) -> None:
+		"""Measure every distinct caption word once; its glyph atlas is built by whichever process renders."""
+		self._renderer.prepare(self._cleaned)
+		logger_config.info(f"Caption vocabulary: {len(self._renderer.words)} distinct words")
+
 	def _clean_word(self, word: str) -> str:
-		return word.strip('.,!?;:"""''').upper()
-	
-	def _calculate_word_duration(self, word_index: int) -> Tuple[float, float, float]:
-		word_data = self.word_timestamps[word_index]
-		start_time = word_data["start"]
-		
-		# Set end time to the start time of the next word for continuity
-		if word_index < len(self.word_timestamps) - 1:
-			end_time = self.word_timestamps[word_index + 1]["start"]
-		else:
-			end_time = word_data["end"]
-		
-		# Ensure we don't exceed video duration
-		end_time = min(end_time, self.video.duration)
-		duration = end_time - start_time
-		
-		return start_time, end_time, duration
+		return word.strip(_STRIP_CHARS).upper()
 	
-	def _create_text_clip(self,
-						words_data: List[Dict],
-						highlight_word_index: int,
-						start_time: float,
-						duration: float,
-						group_start_index: int = 0,
-						is_first_word_in_group: bool = False) -> ImageClip:
-		caption_width = int(self.video.size[0] * self.config.caption_width_ratio)
-
-		caption_parts = []
-		word_to_highlight = None
-		for j, word_data in enumerate(words_data):
-			word = self._clean_word(word_data["word"])
-			if group_start_index + j == highlight_word_index:
-				caption_parts.append((word, self.config.highlight_text_color))
-				word_to_highlight = word
-			else:
-				caption_parts.append((word, self.config.text_color))
-
-		# Load font
-		font = ImageFont.truetype(self.font_path, self.config.font_size)
-
-		# Simulate layout to calculate required height
-		dummy_img = Image.new("RGBA", (caption_width, 10), (0, 0, 0, 0))
-		draw = ImageDraw.Draw(dummy_img)
-
-		space_width = draw.textlength(" ", font=font)
-
-		# Buffer lines and compute dimensions
-		lines = []
-		current_line = []
-		current_line_width = 0
-		max_line_height = 0
-		total_height = 0
-
-		for word, color in caption_parts:
-			word_width = draw.textlength(word, font=font)
-
-			bbox = draw.textbbox((0, 0), word, font=font)
-			word_height = bbox[3] - bbox[1]
-			max_line_height = max(max_line_height, word_height)
-
-			if current_line_width + word_width > caption_width:
-				if current_line:
-					lines.append((current_line, current_line_width - space_width, max_line_height))
-					total_height += max_line_height + self.config.line_spacing
-
-				current_line = []
-				current_line_width = 0
-				max_line_height = word_height
-
-			current_line.append((word, color, word_width))
-			current_line_width += word_width + space_width
-
-		if current_line:
-			lines.append((current_line, current_line_width - space_width, max_line_height))
-			total_height += max_line_height + self.config.line_spacing
-
-		padding = int(self.config.font_size * 0.4)
-		total_height += padding
-
-		img = Image.new("RGBA", (caption_width, total_height), (0, 0, 0, 0))
-		draw = ImageDraw.Draw(img)
-
-		y = 0
-		for line_words, line_width, line_height in lines:
-			if self.config.horizontal_align == "center":
-				x = (caption_width - line_width) / 2
-			elif self.config.horizontal_align == "left":
-				x = 0
-			else:
-				x = caption_width - line_width
-
-			for word, color, word_width in line_words:
-				if word_to_highlight == word:
-					padding_x, padding_y = self.config.highlight_padding
-
-					text_bbox = draw.textbbox((x, y), word, font=font)
-					rect_y0 = text_bbox[1] - padding_y
-					rect_y1 = text_bbox[3] + padding_y
-
-					rect_x0 = x - padding_x
-					rect_x1 = x + word_width + padding_x
-
-					draw.rounded_rectangle(
-						[rect_x0, rect_y0, rect_x1, rect_y1],
-						fill=self.config.highlight_bg_color,
-						radius=15,
-					)
-
-				for dx in range(-self.config.stroke_width, self.config.stroke_width + 1):
-					for dy in range(-self.config.stroke_width, self.config.stroke_width + 1):
-						draw.text((x + dx, y + dy), word, font=font, fill=self.config.stroke_color)
-
-				draw.text((x, y), word, font=font, fill=color)
-
-				x += word_width + space_width
+	def _prepare_word_timings(self) -> None:
+		"""
+		Gather word timings into flat arrays and compute every caption's
+		start, end and duration in one vectorized pass.
+		"""
+		self._starts = np.array([w["start"] for w in self.word_timestamps], dtype=np.float64)
+		self._ends = np.array([w["end"] for w in self.word_timestamps], dtype=np.float64)
 
-			y += line_height + self.config.line_spacing
+		# Each word stays up until the next one starts, capped at the video length
+		next_starts = np.concatenate([self._starts[1:], self._ends[-1:]])
+		self._end_times = np.minimum(next_starts, self.video.duration)
+		self._durations = self._end_times - self._starts
 
-		txt_clip = ImageClip(np.array(img)).set_duration(duration).set_start(start_time)
+		self._valid_mask = (self._starts < self.video.duration) & (self._durations > 0)
 
+	def _place_caption(self, frame: np.ndarray) -> Tuple[np.ndarray, Tuple]:
+		"""Work out where a caption frame goes on screen and trim it to its content."""
 		if self.config.use_safe_zones:
 			from safe_zone import SafeZone
 			
 			_, y_pos = SafeZone.get_caption_position(
 				video_width=self.video.size[0],
 				video_height=self.video.size[1],
-				caption_height=img.height,
+				caption_height=frame.shape[0],
 				position=self.config.vertical_position,
 				padding=self.config.safe_zone_padding
 			)
-			txt_clip = txt_clip.set_position((self.config.horizontal_align, y_pos))
+			position = (self.config.horizontal_align, y_pos)
+			# y_pos is the frame's top edge, so only trim below the text
+			frame = trim_to_content(frame, self.config.horizontal_align, "top")
 		else:
-			txt_clip = txt_clip.set_position(
-				(self.config.horizontal_align, self.config.vertical_align)
-			)
+			position = (self.config.horizontal_align, self.config.vertical_align)
+			frame = trim_to_content(frame, self.config.horizontal_align, self.config.vertical_align)
+
+		return frame, position
 
+	def _create_text_clip(self,
+						frame: np.ndarray,
+						position: Tuple,
+						start_time: float,
+						duration: float,
+						is_first_word_in_group: bool = False) -> ImageClip:
+		txt_clip = utils.rgba_image_clip(frame).set_duration(duration).set_start(start_time)
+		txt_clip = txt_clip.set_position(position)
+
+		scale_functions = []
 		if self.config.use_zoom_animation and is_first_word_in_group:
-			txt_clip = utils.apply_zoom_animation(
-				txt_clip,
+			scale_functions.append(utils.zoom_scale_function(
 				start_scale=self.config.zoom_start_scale,
 				end_scale=self.config.zoom_end_scale,
 				duration=min(self.config.zoom_duration, duration)
+			))
+
+		if self.config.use_fade_and_scale:
+			intensity = self.config.scale_effect_intensity
+			half = duration / 2
+			scale_functions.append(
+				lambda t: max(0.1, 1 + intensity * (1 - abs(t - half) / max(0.1, half)))
+			)
+
+		if scale_functions:
+			txt_clip = utils.apply_scale_table(
+				txt_clip,
+				lambda t: float(np.prod([scale(t) for scale in scale_functions])),
+				fps=self.fps
 			)
 
 		if self.config.use_fade_and_scale:
 			fade_duration = min(self.config.fade_duration, duration * 0.3)
 
-			# Apply scaling effect
-			txt_clip = txt_clip.resize(lambda t: max(0.1, 1 + self.config.scale_effect_intensity * (1 - abs(t - duration / 2) / max(0.1, duration / 2))))
-
 			# Apply fade effects
 			txt_clip = fadein(txt_clip, fade_duration)
 			txt_clip = fadein(txt_clip, fade_duration)
@@ -372,48 +395,65 @@ class CaptionCreator:
 		logger_config.info(f"Setting caption width to {caption_width}px")
 		
 		try:
-			text_clips = []
-			for i in range(len(self.word_timestamps)):
-				group_start_index = (i // self.config.word_count) * self.config.word_count
-				group_end_index = min(len(self.word_timestamps), group_start_index + self.config.word_count)
-				group_words_data = self.word_timestamps[group_start_index:group_end_index]
-				
-				start_time, _, duration = self._calculate_word_duration(i)
-				
-				if start_time >= self.video.duration:
-					break
-				
-				if duration <= 0:
+			total_words = len(self.word_timestamps)
+			word_count = self.config.word_count
+
+			# One render job per word group, one frame per visible word in it
+			jobs = []
+			job_frames = []
+			last_frame = None
+			for i in np.flatnonzero(self._valid_mask).tolist():
+				start_time = float(self._starts[i])
+				duration = float(self._durations[i])
+
+				# Too short to be seen: keep the previous caption up instead of leaving a gap
+				if duration < self.config.min_word_duration:
+					if last_frame is not None and abs(last_frame[1] + last_frame[2] - start_time) < 1e-6:
+						last_frame[2] += duration
 					continue
-				
-				is_first_word = (i == group_start_index)
-				txt_clip = self._create_text_clip(
-					words_data=group_words_data,
-					highlight_word_index=i if self.config.highlight_text else -1,
-					start_time=start_time,
-					duration=duration,
-					group_start_index=group_start_index,
-					is_first_word_in_group=is_first_word
-				)
-				
-				text_clips.append(txt_clip)
-				
-				logger_config.info(f"Processed word {i + 1}/{len(self.word_timestamps)}", overwrite=True)
 
-			final_clip = CompositeVideoClip([self.video] + text_clips)
-			w, h = final_clip.size
-			new_w = w if w % 2 == 0 else w - 1
-			new_h = h if h % 2 == 0 else h - 1
-
-			if (new_w, new_h) != (w, h):
-				logger_config.warning(
-					f"⚠️ Final video size {w}x{h} is not divisible by 2. "
-					f"Resizing to {new_w}x{new_h} to satisfy H.264."
-				)
-				final_clip = final_clip.resize((new_w, new_h))
-			utils.write_videofile(final_clip, self.config.output_path, fps=self.fps)
-			final_clip.close()
-			
+				group_start_index = (i // word_count) * word_count
+				highlight = i - group_start_index if self.config.highlight_text else None
+
+				# Same group and same highlight renders the same image: stretch the previous frame
+				if (last_frame is not None
+						and job_frames[-1][0] == group_start_index
+						and jobs[-1][2][-1] == highlight
+						and abs(last_frame[1] + last_frame[2] - start_time) < 1e-6):
+					last_frame[2] += duration
+					continue
+
+				if not job_frames or job_frames[-1][0] != group_start_index:
+					group_end_index = min(total_words, group_start_index + word_count)
+					group_words = self._cleaned[group_start_index:group_end_index]
+					jobs.append((group_words, caption_width, []))
+					job_frames.append((group_start_index, []))
+
+				last_frame = [i, start_time, duration]
+				jobs[-1][2].append(highlight)
+				job_frames[-1][1].append(last_frame)
+
+			workers = self.config.render_workers or common.get_threads()
+			rendered = render_groups(self._renderer, jobs, workers)
+			captions = []
+			with _phase("render captions"):
+				for (group_start_index, timings), frames in zip(job_frames, rendered):
+					for (i, start_time, duration), frame in zip(timings, frames):
+						frame, position = self._place_caption(frame)
+						captions.append((frame, position, start_time, duration, i == group_start_index))
+
+						logger_config.info(f"Processed word {i + 1}/{total_words}", overwrite=True)
+
+			if self.config.use_ffmpeg_overlay and self.config.keep_original_aspect:
+				with _phase("ffmpeg overlay"):
+					self._write_with_ffmpeg_overlay(captions)
+			else:
+				if self.config.use_ffmpeg_overlay:
+					logger_config.warning(
+						"ffmpeg overlay needs keep_original_aspect (no crop/pad); rendering with MoviePy."
+					)
+				self._write_with_moviepy(captions)
+
 		finally:
 			# Remove temporary CFR file
 			if getattr(self, "cfr_video_path", None) and os.path.exists(self.cfr_video_path):
@@ -421,8 +461,120 @@ class CaptionCreator:
 				logger_config.debug(f"Cleaned up temporary CFR file")
 		
 		logger_config.success(f"Video saved to: {self.config.output_path}")
+		_log_phases()
 		return self.config.output_path
 	
+	def _write_with_moviepy(self, captions: List[Tuple]) -> None:
+		text_clips = []
+		for frame, position, start_time, duration, is_first_word in captions:
+			with _phase("text clip"):
+				text_clips.append(self._create_text_clip(
+					frame=frame,
+					position=position,
+					start_time=start_time,
+					duration=duration,
+					is_first_word_in_group=is_first_word
+				))
+
+		with _phase("composite"):
+			final_clip = CompositeVideoClip([self.video] + text_clips)
+		w, h = final_clip.size
+		new_w = w if w % 2 == 0 else w - 1
+		new_h = h if h % 2 == 0 else h - 1
+
+		if (new_w, new_h) != (w, h):
+			logger_config.warning(
+				f"⚠️ Final video size {w}x{h} is not divisible by 2. "
+				f"Resizing to {new_w}x{new_h} to satisfy H.264."
+			)
+			final_clip = final_clip.resize((new_w, new_h))
+		with _phase("encode"):
+			if self.config.need_audio:
+				utils.write_videofile(final_clip, self.config.output_path, fps=self.fps)
+			else:
+				silent_path = f'{constants.TEMP_OUTPUT}/silent_{utils.generate_random_string()}.mp4'
+				utils.write_videofile(final_clip, silent_path, fps=self.fps)
+				utils.mux_audio(silent_path, self.cfr_video_path or self.video_path, self.config.output_path)
+				utils.remove_file(silent_path)
+		final_clip.close()
+
+	def _write_with_ffmpeg_overlay(self, captions: List[Tuple]) -> None:
+		"""
+		Burn the captions in with ffmpeg instead of compositing every frame in Python.
+		Each caption is written once as a full-size transparent PNG, the PNGs are
+		played back as one stream with the concat demuxer and laid over the video
+		with a single overlay filter. Caption animations are not applied.
+		"""
+		if self.config.use_fade_and_scale or self.config.use_zoom_animation:
+			logger_config.warning("ffmpeg overlay renders static captions; fade/scale/zoom are skipped.")
+
+		video_w, video_h = self.video.size
+		out_w, out_h = video_w - video_w % 2, video_h - video_h % 2
+		work_dir = os.path.abspath(f'{constants.TEMP_OUTPUT}/overlay_{utils.generate_random_string()}')
+		utils.create_directory(work_dir)
+
+		try:
+			blank_path = os.path.join(work_dir, "blank.png")
+			Image.new("RGBA", (video_w, video_h), (0, 0, 0, 0)).save(blank_path, compress_level=1)
+
+			entries = []
+			current_time = 0.0
+			for n, (frame, position, start_time, duration, _) in enumerate(captions):
+				if start_time > current_time + 1e-6:
+					entries.append((blank_path, start_time - current_time))
+
+				canvas = np.zeros((video_h, video_w, 4), dtype=np.uint8)
+				x, y = self._resolve_position(position, frame.shape[1], frame.shape[0])
+				alpha_blit(canvas, frame, x, y)
+				caption_path = os.path.join(work_dir, f"caption_{n}.png")
+				Image.fromarray(canvas, "RGBA").save(caption_path, compress_level=1)
+
+				entries.append((caption_path, duration))
+				current_time = start_time + duration
+
+			entries.append((blank_path, max(0.0, self.video.duration - current_time)))
+
+			# The concat demuxer ignores the last duration unless the file is listed again
+			concat_path = os.path.join(work_dir, "captions.ffconcat")
+			with open(concat_path, "w") as f:
+				f.write("ffconcat version 1.0\n")
+				for path, duration in entries:
+					f.write(f"file '{path}'\nduration {duration:.6f}\n")
+				f.write(f"file '{blank_path}'\n")
+
+			filter_graph = (
+				f"[0:v]scale={video_w}:{video_h}[base];"
+				f"[1:v]format=rgba[captions];"
+				f"[base][captions]overlay=0:0:eof_action=pass,"
+				f"crop={out_w}:{out_h}:0:0,format=yuv420p[out]"
+			)
+			cmd = [
+				'ffmpeg', '-y',
+				'-i', self.cfr_video_path or self.video_path,
+				'-f', 'concat', '-safe', '0', '-i', concat_path,
+				'-filter_complex', filter_graph,
+				'-map', '[out]',
+				'-map', '0:a?',
+				'-c:v', self.config.overlay_codec,
+				'-c:a', 'aac',
+				'-b:a', '192k',
+				'-movflags', '+faststart',
+				self.config.output_path
+			]
+			common.run_ffmpeg(cmd)
+		finally:
+			utils.remove_directory(work_dir)
+
+	def _resolve_position(self, position: Tuple, width: int, height: int) -> Tuple[int, int]:
+		"""Turn a MoviePy-style position into the pixel offset MoviePy would blit at."""
+		video_w, video_h = self.video.size
+		x, y = position
+		anchors_x = {"left": 0, "center": (video_w - width) / 2, "right": video_w - width}
+		anchors_y = {"top": 0, "center": (video_h - height) / 2, "bottom": video_h - height}
+		x = anchors_x.get(x, x) if isinstance(x, str) else x
+		y = anchors_y.get(y, y) if isinstance(y, str) else y
+		return int(x), int(y)
+
 	def close(self) -> None:
 		"""Clean up resources."""
 		if self.video:
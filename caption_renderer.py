@@ -0,0 +1,233 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+import functools
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from glyph_atlas import GlyphAtlas
+from text_layout import wrap_lines
+
+# (words, caption_width, highlight index per frame or None for no highlight)
+RenderJob = Tuple[Sequence[str], int, Sequence[Optional[int]]]
+
+@functools.lru_cache(maxsize=32)
+def load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(font_path, font_size)
+
+@functools.lru_cache(maxsize=4096)
+def _word_metrics(word: str, font_path: str, font_size: int) -> Tuple[float, int, int]:
+    """Return (advance_width, height, top) of a word as laid out by draw.text()."""
+    font = load_font(font_path, font_size)
+    _, top, _, bottom = font.getbbox(word)
+    return font.getlength(word), bottom - top, top
+
+@functools.lru_cache(maxsize=256)
+def _render_highlight_box(width: int, height: int, color: str) -> np.ndarray:
+    box = Image.new("RGBA", (max(1, width), max(1, height)), (0, 0, 0, 0))
+    ImageDraw.Draw(box).rounded_rectangle(
+        [0, 0, box.width - 1, box.height - 1],
+        fill=color,
+        radius=15,
+    )
+    rgba = np.asarray(box)
+    rgba.flags.writeable = False
+    return rgba
+
+def alpha_blit(dst: np.ndarray, tile: np.ndarray, x: int, y: int) -> None:
+    """Composite an RGBA tile over dst in place at (x, y), clipped to dst bounds."""
+    tile_h, tile_w = tile.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + tile_w, dst.shape[1]), min(y + tile_h, dst.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    src = tile[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.float32) / 255.0
+    region = dst[y0:y1, x0:x1]
+    base = region.astype(np.float32) / 255.0
+
+    src_a = src[..., 3:4]
+    dst_a = base[..., 3:4] * (1.0 - src_a)
+    out_a = src_a + dst_a
+    out_rgb = (src[..., :3] * src_a + base[..., :3] * dst_a) / np.maximum(out_a, 1e-6)
+
+    region[..., :3] = np.clip(out_rgb * 255.0 + 0.5, 0, 255)
+    region[..., 3:4] = np.clip(out_a * 255.0 + 0.5, 0, 255)
+
+def trim_to_content(frame: np.ndarray, horizontal: str, vertical: str) -> np.ndarray:
+    """
+    Drop fully transparent margins from a caption frame without moving its
+    content on screen: only the sides away from the alignment anchor are
+    cut, and centered axes are cut by the same amount on both sides.
+    """
+    alpha = frame[..., 3]
+    cols = np.flatnonzero(alpha.any(axis=0))
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if cols.size == 0:
+        return frame
+
+    def span(used, length, anchor):
+        before, after = int(used[0]), length - 1 - int(used[-1])
+        if anchor == "center":
+            before = after = min(before, after)
+        elif anchor in ("left", "top"):
+            before = 0
+        else:
+            after = 0
+        return slice(before, length - after)
+
+    height, width = alpha.shape
+    return frame[span(rows, height, vertical), span(cols, width, horizontal)]
+
+class CaptionRenderer:
+    """
+    Lays out caption word groups and assembles their RGBA frames from a
+    glyph atlas. Holds no video state, so it can be shipped to worker processes.
+    """
+
+    def __init__(self, font_path: str, config):
+        self.font_path = font_path
+        self.config = config
+        self.font = load_font(font_path, config.font_size)
+        self.space_width = self.font.getlength(" ")
+        self.atlas = GlyphAtlas(self.font, config.stroke_width, config.stroke_color)
+        self.words: Tuple[str, ...] = ()
+        self._atlas_ready = False
+        self._metrics = {}
+
+    def prepare(self, words: Iterable[str]) -> None:
+        """
+        Measure every distinct word. The atlas is only rasterized on the first
+        blit, so a process that hands rendering to workers never builds one.
+        """
+        self.words = tuple(dict.fromkeys(words))
+        self._metrics = {}
+        for word in self.words:
+            self.word_metrics(word)
+        self._atlas_ready = False
+
+    def _ensure_atlas(self) -> None:
+        if self._atlas_ready:
+            return
+
+        colors = [self.config.text_color]
+        if self.config.highlight_text:
+            colors.append(self.config.highlight_text_color)
+        self.atlas.build(self.words, colors)
+        self._atlas_ready = True
+
+    def word_metrics(self, word: str) -> Tuple[float, int, int]:
+        metrics = self._metrics.get(word)
+        if metrics is None:
+            metrics = _word_metrics(word, self.font_path, self.config.font_size)
+            self._metrics[word] = metrics
+        return metrics
+
+    def layout_group(self, words: Sequence[str], caption_width: int) -> Tuple[List[Tuple[str, float, int]], int]:
+        """
+        Wrap a group of cleaned words into lines.
+        Returns the (word, x, y) draw origin of every word and the caption height.
+        """
+        metrics = [self.word_metrics(word) for word in words]
+        widths = np.array([m[0] for m in metrics], dtype=np.float64)
+        heights = np.array([m[1] for m in metrics], dtype=np.int64)
+
+        line_starts, line_widths, line_heights, line_ys = wrap_lines(
+            widths, heights, float(caption_width), self.space_width, self.config.line_spacing
+        )
+
+        padding = int(self.config.font_size * 0.4)
+        total_height = int(line_heights.sum()) + len(line_heights) * self.config.line_spacing + padding
+
+        placements = []
+        line_ends = line_starts[1:].tolist() + [len(words)]
+        for start, end, line_width, y in zip(line_starts.tolist(), line_ends, line_widths.tolist(), line_ys.tolist()):
+            if self.config.horizontal_align == "center":
+                x = (caption_width - line_width) / 2
+            elif self.config.horizontal_align == "left":
+                x = 0
+            else:
+                x = caption_width - line_width
+
+            for k in range(start, end):
+                placements.append((words[k], x, y))
+                x += metrics[k][0] + self.space_width
+
+        return placements, total_height
+
+    def _blit_word(self, frame: np.ndarray, word: str, color: str, x: float, y: int) -> None:
+        self._ensure_atlas()
+        tile, offset_x, offset_y = self.atlas.tile(word, color)
+        alpha_blit(frame, tile, int(round(x)) + offset_x, y + offset_y)
+
+    def render_baseline(self, placements: List[Tuple[str, float, int]], size: Tuple[int, int]) -> np.ndarray:
+        """Render every word of a group in the regular text color."""
+        frame = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+        for word, x, y in placements:
+            self._blit_word(frame, word, self.config.text_color, x, y)
+        return frame
+
+    def render_highlight(self, baseline: np.ndarray, placement: Tuple[str, float, int]) -> np.ndarray:
+        """Put the highlight box under the group baseline and redraw the highlighted word on top."""
+        word, x, y = placement
+        word_width, word_height, word_top = self.word_metrics(word)
+        padding_x, padding_y = self.config.highlight_padding
+
+        rect_x0 = int(round(x - padding_x))
+        rect_y0 = y + word_top - padding_y
+        rect_x1 = int(round(x + word_width + padding_x))
+        rect_y1 = y + word_top + word_height + padding_y
+
+        height, width = baseline.shape[:2]
+        frame = baseline.copy()
+
+        # Outside the box the frame is just the baseline; only blend where the box sits underneath
+        box = _render_highlight_box(
+            rect_x1 - rect_x0 + 1, rect_y1 - rect_y0 + 1, self.config.highlight_bg_color
+        )
+        x0, y0 = max(rect_x0, 0), max(rect_y0, 0)
+        x1, y1 = min(rect_x0 + box.shape[1], width), min(rect_y0 + box.shape[0], height)
+        if x0 < x1 and y0 < y1:
+            under = box[y0 - rect_y0:y1 - rect_y0, x0 - rect_x0:x1 - rect_x0].copy()
+            alpha_blit(under, baseline[y0:y1, x0:x1], 0, 0)
+            frame[y0:y1, x0:x1] = under
+
+        if self.config.highlight_text_color != self.config.text_color:
+            self._blit_word(frame, word, self.config.highlight_text_color, x, y)
+
+        return frame
+
+    def render_group(self, words: Sequence[str], caption_width: int,
+                     highlights: Sequence[Optional[int]]) -> List[np.ndarray]:
+        """Lay a group out once and return one frame per entry in highlights."""
+        placements, caption_height = self.layout_group(words, caption_width)
+        baseline = self.render_baseline(placements, (caption_width, caption_height))
+
+        return [
+            baseline if index is None else self.render_highlight(baseline, placements[index])
+            for index in highlights
+        ]
+
+_worker_renderer: Optional[CaptionRenderer] = None
+
+def _init_worker(font_path: str, config, words: Tuple[str, ...]) -> None:
+    global _worker_renderer
+    _worker_renderer = CaptionRenderer(font_path, config)
+    _worker_renderer.prepare(words)
+
+def _render_job(job: RenderJob) -> List[np.ndarray]:
+    return _worker_renderer.render_group(*job)
+
+def render_groups(renderer: CaptionRenderer, jobs: List[RenderJob], workers: int) -> Iterator[List[np.ndarray]]:
+    """
+    Render caption groups in order. With more than one worker the groups are
+    spread over a process pool. Workers get only the font, style and word
+    list and build their own atlas, so no atlas is pickled under spawn.
+    """
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        for job in jobs:
+            yield renderer.render_group(*job)
+        return
+
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(renderer.font_path, renderer.config, renderer.words)) as executor:
+        yield from executor.map(_render_job, jobs, chunksize=chunksize)
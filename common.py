@@ -7,10 +7,17 @@ from datetime import datetime, timedelta
 from custom_logger import logger_config
 import secrets
 import hashlib
-import random
+import functools
+import asyncio
+import json
 import time
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import re
+import stat
+import struct
+import zlib
+import numpy as np
 import ffmpeg
 import requests
 from PIL import Image, PngImagePlugin
@@ -33,75 +40,131 @@ def dir_exists(file_path):
         pass
     return False
 
+def scan_tree(directory):
+    """
+    Yield a DirEntry for everything under directory, top-down like os.walk.
+    File types come from the directory listing itself, so no entry is stat()ed
+    and symlinked directories are listed but not followed.
+    """
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError:
+        return
+
+    for entry in entries:
+        yield entry
+        if entry.is_dir(follow_symlinks=False):
+            yield from scan_tree(entry.path)
+
+def _drop_zone_identifier(entry):
+    """Windows download markers copied along with files; deleted as they are found."""
+    if entry.name.endswith(":Zone.Identifier"):
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+        return True
+    return False
+
 def list_files_recursive(directory):
-    remove_zone_identifier(directory)
-    # Initialize an empty array to store the file paths
-    file_list = []
-    
-    # Walk through the directory recursively
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            # Get the full path of the file and append to the array
-            file_list.append(os.path.join(root, file))
-    
-    return file_list
+    return [
+        entry.path for entry in scan_tree(directory)
+        if not entry.is_dir() and not _drop_zone_identifier(entry)
+    ]
+
+def list_files_with_size(directory):
+    """Yield (path, size in bytes) for every file under directory from a single walk."""
+    for entry in scan_tree(directory):
+        if not entry.is_dir() and not _drop_zone_identifier(entry):
+            yield entry.path, entry.stat().st_size
 
 def list_directories_recursive(directory):
-    remove_zone_identifier(directory)
-    # Initialize an empty list to store the directory names
     directory_list = []
-    
-    # Walk through the directory recursively
-    for root, dirs, files in os.walk(directory):
-        for dir_name in dirs:
-            # Get the full path of the directory and append to the list
-            directory_list.append(os.path.join(root, dir_name))
-    
+    for entry in scan_tree(directory):
+        if entry.is_dir():
+            directory_list.append(entry.path)
+        else:
+            _drop_zone_identifier(entry)
     return directory_list
 
 def remove_zone_identifier(directory):
-    try:
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.endswith(":Zone.Identifier"):
-                    full_path = os.path.join(root, file)
-                    remove_file(full_path)
-    except: pass
+    for entry in scan_tree(directory):
+        if not entry.is_dir():
+            _drop_zone_identifier(entry)
 
 
 def list_files(directory):
+    # Markers anywhere below directory are cleaned up, as before
     remove_zone_identifier(directory)
-    # Initialize an empty array to store the file paths
-    file_list = []
-    
-    # Get the list of files in the given directory (non-recursive)
-    for file in os.listdir(directory):
-        # Construct the full path and check if it's a file
-        full_path = os.path.join(directory, file)
-        if os.path.isfile(full_path):
-            file_list.append(full_path)
-    
-    return file_list
+
+    with os.scandir(directory) as it:
+        return [entry.path for entry in it if entry.is_file()]
 
 def remove_path(path):
-    remove_file(path, True)
-    remove_all_files_and_dirs(path)
+    """Remove a file, symlink or whole directory tree, whichever path is."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    except OSError as e:
+        logger_config.warning(f"Failed to delete {path}. Reason: {e}")
+        return
+
+    if stat.S_ISDIR(mode):
+        remove_all_files_and_dirs(path)
+    else:
+        remove_file(path)
+
+# Waits between attempts for a file still held open elsewhere
+_REMOVE_RETRY_DELAYS = (0.1, 0.2, 0.4, 0.8, 1.0)
 
 def remove_file(file_path, retry=True):
-    try:
-        # Check if the file exists
-        if os.path.exists(file_path):
-            Path(file_path).unlink()
+    delays = _REMOVE_RETRY_DELAYS if retry else ()
+    for attempt in range(len(delays) + 1):
+        try:
+            os.unlink(file_path)
             logger_config.success(f"{file_path} has been removed successfully.")
-    except Exception as e:
-        logger_config.warning(f"Error occurred while trying to remove the file: {e}")
-        if retry:
-            logger_config.debug("retrying after 10 seconds", seconds=10)
-            remove_file(file_path, False)
+            return
+        except FileNotFoundError:
+            return
+        except IsADirectoryError as e:
+            logger_config.warning(f"Error occurred while trying to remove the file: {e}")
+            return
+        except OSError as e:
+            if attempt == len(delays):
+                logger_config.warning(f"Error occurred while trying to remove the file: {e}")
+                return
+            time.sleep(delays[attempt])
+
+def _remove_tree(directory):
+    """Delete a directory tree from a single scandir walk; raises OSError on the first failure."""
+    files, dirs = [], []
+    for entry in scan_tree(directory):
+        (dirs if entry.is_dir(follow_symlinks=False) else files).append(entry.path)
+
+    if len(files) >= 256:
+        # Overlap the per-file unlink round trips (slow disks, network mounts)
+        with ThreadPoolExecutor(max_workers=min(32, get_threads() * 4)) as executor:
+            list(executor.map(os.unlink, files))
+    else:
+        for path in files:
+            os.unlink(path)
+
+    # scan_tree lists parents before children, so reversed order empties each directory first
+    for path in reversed(dirs):
+        os.rmdir(path)
+    os.rmdir(directory)
 
 def remove_all_files_and_dirs(directory):
     try:
-        shutil.rmtree(directory)  # Recursively delete a directory
+        if os.path.islink(directory):
+            shutil.rmtree(directory)  # Refuses symlinks; reported below as before
+        else:
+            try:
+                _remove_tree(directory)
+            except OSError:
+                shutil.rmtree(directory)  # Whatever the fast path could not remove
     except Exception as e:
         logger_config.warning(f"Failed to delete {directory}. Reason: {e}")
 
@@ -134,18 +197,14 @@ def get_date(when=0):
     return sub_day_str
 
 def generate_random_string_from_input(input_string, length=10):
-    # Hash the input string to get a consistent value
-    hash_object = hashlib.md5(input_string.encode())
-    hashed_string = hash_object.hexdigest()
-
-    # Use the hash to seed the random number generator
-    random.seed(hashed_string)
+    # Map the bytes of a hash of the input straight onto the alphabet, so the
+    # same input always gives the same string without reseeding `random`
+    digest = hashlib.blake2b(input_string.encode(), digest_size=min(64, max(length, 16))).digest()
+    if length > len(digest):
+        digest = hashlib.shake_256(input_string.encode()).digest(length)
 
-    # Generate a random string based on the seed
     characters = string.ascii_letters + string.digits
-    random_string = ''.join(random.choice(characters) for _ in range(length))
-
-    return random_string
+    return ''.join(characters[byte % len(characters)] for byte in digest[:length])
 
 def rename_file(current_name, new_name):
     try:
@@ -161,43 +220,109 @@ def copy(source, dest):
     except Exception as e:
         logger_config.error(f"An error occurred: {e}")
 
-def clean_text(text):
-    text = re.sub(r"\\+", "", text)
-    return re.sub(r'\s+', ' ', text).strip()
+_BACKSLASHES = re.compile(r"\\+")
+_WHITESPACE = re.compile(r'\s+')
 
-def get_media_metadata(file_path):
+def clean_text(text):
+    text = _BACKSLASHES.sub("", text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+@functools.lru_cache(maxsize=256)
+def _probe_media(file_path, mtime_ns, size_bytes):
+    """
+    ffprobe a file once per (mtime, size). Results are also kept in a
+    <file>.probe.json sidecar so other processes can skip the probe too.
+    """
+    sidecar = f"{file_path}.probe.json"
+    key = [mtime_ns, size_bytes]
     try:
-        probe = ffmpeg.probe(file_path, v='error', select_streams='v:0', show_entries='format=duration,streams')
+        with open(sidecar, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return tuple(cached["metadata"])
+    except (OSError, ValueError):
+        pass
+
+    probe = ffmpeg.probe(file_path, v='error', select_streams='v:0', show_entries='format=duration,streams')
 
-        # Duration in float seconds
-        duration_in_sec_float = float(probe['format']['duration'])
-        duration_in_sec_int = int(duration_in_sec_float)
+    # Duration in float seconds
+    duration_in_sec_float = float(probe['format']['duration'])
+    duration_in_sec_int = int(duration_in_sec_float)
 
-        # File size in MB
-        size = int(os.path.getsize(file_path) // (1024 * 1024))
+    # File size in MB
+    size = int(size_bytes // (1024 * 1024))
 
-        fps = None
-        for stream in probe['streams']:
-            if stream['codec_type'] == 'video':
-                fps = eval(stream['r_frame_rate'])  # Frames per second (r_frame_rate is in format num/den)
+    fps = None
+    for stream in probe['streams']:
+        if stream['codec_type'] == 'video':
+            # Frames per second (r_frame_rate is in format num/den)
+            num, _, den = stream['r_frame_rate'].partition('/')
+            fps = int(num) / int(den) if den else float(num)
+
+    metadata = (duration_in_sec_int, duration_in_sec_float, size, fps)
+    try:
+        tmp_path = f"{sidecar}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "metadata": metadata}, f)
+        os.replace(tmp_path, sidecar)
+    except OSError:
+        pass  # Read-only media folders just miss out on the shared cache
 
-        return duration_in_sec_int, duration_in_sec_float, size, fps
+    return metadata
+
+def get_media_metadata(file_path):
+    """Return (duration_int, duration_float, size_mb, fps) for a media file."""
+    try:
+        # The stat doubles as the cache key, so an edited file is probed again
+        st = os.stat(file_path)
+        return _probe_media(os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
     except Exception as e:
         logger_config.error(f"Error retrieving media metadata: {e}")
         return None, None, None, None
 
+# Options every h264_nvenc encode here uses; get_h264_encoder() probes with exactly these
+NVENC_PRESET = 'p4'  # p1-p7 need ffmpeg 4.3+ (NVENC SDK 10 headers)
+# MoviePy only forces yuv420p for libx264; without it nvenc may pick a 4:4:4 RGB format
+NVENC_PARAMS = ('-pix_fmt', 'yuv420p', '-rc', 'vbr')
+NVENC_CONSTANT_QUALITY = ('-cq', '23', '-b:v', '0')
+
+@functools.lru_cache(maxsize=None)
+def get_h264_encoder(ffmpeg_binary='ffmpeg'):
+    """
+    'h264_nvenc' when this ffmpeg can really encode on an NVIDIA GPU, else 'libx264'.
+    Being listed in -encoders is not enough (no driver, no GPU, too old for the
+    p1-p7 presets), so a tiny test encode with the writers' options is run once.
+    """
+    cmd = [
+        ffmpeg_binary, '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+        '-frames:v', '1', '-c:v', 'h264_nvenc', '-preset', NVENC_PRESET,
+        *NVENC_PARAMS, *NVENC_CONSTANT_QUALITY, '-f', 'null', '-'
+    ]
+    try:
+        subprocess.run(cmd, capture_output=True, check=True, timeout=30)
+        return 'h264_nvenc'
+    except (OSError, subprocess.SubprocessError):
+        return 'libx264'
+
 def write_videofile(video_clip, output_path, fps=24):
+    from moviepy.config import get_setting
+
+    codec = get_h264_encoder(get_setting("FFMPEG_BINARY"))
+    extra = {'preset': NVENC_PRESET, 'ffmpeg_params': list(NVENC_PARAMS)} if codec == 'h264_nvenc' else {}
+
     audio_file = f'{generate_random_string()}.mp3'
     video_clip.write_videofile(
         output_path,
         fps=fps,
-        codec='libx264',
+        codec=codec,
         # audio_codec='aac',
         # preset='faster',  # Faster encoding, slightly larger file
         threads = get_threads(),
         bitrate='8000k',  # Adjust based on your quality needs
         remove_temp=True,
-        temp_audiofile=audio_file
+        temp_audiofile=audio_file,
+        **extra
     )
     remove_file(audio_file)
 
@@ -209,23 +334,103 @@ def write_audiofile(audio_clip, output_path, fps=44100, codec="libmp3lame", bitr
         bitrate=bitrate
     )
 
+# Shared so repeated calls to the same host reuse TCP/TLS connections
+_session = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=8)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
 def download_image(image_url, save_path, throw_error=False):
-	response = requests.get(image_url, stream=True)
-	if response.status_code == 200:
-		with open(save_path, 'wb') as file:
-			for chunk in response.iter_content(1024):
-				file.write(chunk)
-	elif throw_error:
-		raise ValueError(f"Error: Unable to download image, status code {response.status_code}")
+	# Closing the response hands its connection back to the shared pool, even when the body is never read
+	with _session.get(image_url, stream=True) as response:
+		if response.status_code == 200:
+			# Let urllib3 undo any gzip/deflate so the bytes on disk match iter_content()
+			response.raw.decode_content = True
+			with open(save_path, 'wb') as file:
+				shutil.copyfileobj(response.raw, file, length=1 << 20)
+		elif throw_error:
+			raise ValueError(f"Error: Unable to download image, status code {response.status_code}")
 
 def get_html_content(url):
-    response = requests.get(url)
+    response = _session.get(url)
     if response.status_code != 200:
         raise ValueError(f"Error: Unable to fetch page, status code {response.status_code}")
 
     return response.content
 
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_TEXT_CHUNKS = (b"tEXt", b"zTXt", b"iTXt")
+
+def _png_text_chunk(key, value):
+    try:
+        chunk_type, data = b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1")
+    except UnicodeEncodeError:
+        # Uncompressed iTXt with empty language tag and translated keyword
+        chunk_type, data = b"iTXt", key.encode("latin-1") + b"\0\0\0\0\0" + value.encode("utf-8")
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
 def write_to_png(data_str, image_path='media/sliding_dialog_shorts/ChatGPT Image Apr 3, 2025, 02_03_23 PM.png'):
+    """
+    Store data_str as the PNG's Comment text chunk. The chunk list is rewritten
+    around the existing image data, so nothing is decoded or recompressed.
+    It goes before the first IDAT, where Image.open() reads it without a full load.
+    """
+    with open(image_path, "rb") as src:
+        is_png = src.read(len(_PNG_SIGNATURE)) == _PNG_SIGNATURE
+    if not is_png:
+        return _reencode_png_with_comment(data_str, image_path)
+
+    with open(image_path, "rb") as src:
+        src.seek(len(_PNG_SIGNATURE))
+        comment = _png_text_chunk("Comment", data_str)
+        saw_end = False
+        tmp_path = f"{image_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as dst:
+                dst.write(_PNG_SIGNATURE)
+                while True:
+                    header = src.read(8)
+                    if len(header) < 8:
+                        break
+                    length, chunk_type = struct.unpack(">I4s", header)
+
+                    if chunk_type in _PNG_TEXT_CHUNKS:
+                        body = src.read(length + 4)
+                        if len(body) < length + 4:
+                            raise ValueError("Truncated PNG chunk")
+                        if body.startswith(b"Comment\0"):
+                            continue  # Replaced by the new chunk
+                        dst.write(header + body)
+                        continue
+
+                    if comment and chunk_type in (b"IDAT", b"IEND"):
+                        dst.write(comment)
+                        comment = None
+                    dst.write(header)
+                    _copy_exact(src, dst, length + 4)  # Chunk data and CRC, untouched
+                    if chunk_type == b"IEND":
+                        saw_end = True
+                        break
+
+            # A file cut off before IEND would otherwise be installed without the comment
+            if comment is not None or not saw_end:
+                raise ValueError("Truncated PNG")
+            os.replace(tmp_path, image_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+def _copy_exact(src, dst, size, buffer_size=1 << 20):
+    while size > 0:
+        data = src.read(min(size, buffer_size))
+        if not data:
+            raise ValueError("Truncated PNG chunk")
+        dst.write(data)
+        size -= len(data)
+
+def _reencode_png_with_comment(data_str, image_path):
+    # Not actually a PNG on disk: convert it the old way
     with Image.open(image_path) as img:
         img_copy = img.copy()
 
@@ -238,22 +443,34 @@ def read_from_png(image_path='media/sliding_dialog_shorts/ChatGPT Image Apr 3, 2
     with Image.open(image_path) as image:
         return image.info.get("Comment")
 
-def is_mostly_black(img, black_pixel_threshold=0.9, black_rgb_threshold=10):
+def is_mostly_black(img, black_pixel_threshold=0.9, black_rgb_threshold=10, exact=False):
         """
         Returns True if >= 90% of pixels are near black.
         `black_rgb_threshold` defines how dark a pixel must be to count as black.
+
+        By default this is an estimate: the ratio is first measured on every 8th
+        pixel of every 8th row, and that answer is returned when it is more than
+        5 points from the threshold. Natural frames come out the same, but
+        content repeating every 8 px can fool it. Pass exact=True to always
+        count every pixel.
         """
-        img = img.convert("RGB")
-        pixels = list(img.getdata())
-        total_pixels = len(pixels)
-        black_pixels = sum(
-            1 for r, g, b in pixels if r <= black_rgb_threshold and g <= black_rgb_threshold and b <= black_rgb_threshold
-        )
-        return (black_pixels / total_pixels) >= black_pixel_threshold
+        arr = np.asarray(img.convert("RGB"), dtype=np.uint8)
+
+        if not exact:
+            sample_ratio = (arr[::8, ::8] <= black_rgb_threshold).all(axis=2).mean()
+            if abs(sample_ratio - black_pixel_threshold) > 0.05:
+                return sample_ratio >= black_pixel_threshold
+
+        mask = (arr <= black_rgb_threshold).all(axis=2)
+        return mask.mean() >= black_pixel_threshold
 
 def is_server_alive(url):
     try:
-        response = requests.get(url, timeout=3)
+        # HEAD skips the body; servers that refuse it get a streamed GET whose body is never read
+        response = _session.head(url, timeout=3, allow_redirects=True)
+        if response.status_code == 405:
+            with _session.get(url, timeout=3, stream=True) as response:
+                return response.status_code == 200
         return response.status_code == 200
     except requests.exceptions.RequestException:
         return False
@@ -271,4 +488,22 @@ def run_ffmpeg(cmd):
         "-threads", str(threads)
     ] + cmd[1:]
     logger_config.debug(f"Running command: {' '.join(cmd)}")
-    return subprocess.run(cmd, capture_output=True, text=True, check=True)
\ No newline at end of file
+    return subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+# Awaitable versions of the blocking helpers above. They run on the default
+# thread pool so an event loop keeps serving other requests meanwhile.
+
+async def get_media_metadata_async(file_path):
+    return await asyncio.to_thread(get_media_metadata, file_path)
+
+async def download_image_async(image_url, save_path, throw_error=False):
+    return await asyncio.to_thread(download_image, image_url, save_path, throw_error)
+
+async def write_to_png_async(data_str, image_path):
+    return await asyncio.to_thread(write_to_png, data_str, image_path)
+
+async def read_from_png_async(image_path):
+    return await asyncio.to_thread(read_from_png, image_path)
+
+async def is_mostly_black_async(img, black_pixel_threshold=0.9, black_rgb_threshold=10, exact=False):
+    return await asyncio.to_thread(is_mostly_black, img, black_pixel_threshold, black_rgb_threshold, exact)
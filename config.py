@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field, asdict, fields
-from typing import List, Tuple, Literal
+from typing import List, Tuple, Literal, Optional
 import utils
 import json
 import constants
@@ -12,16 +12,17 @@ class WordTimestamp:
     start: float
     end: float
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
     """A single configuration class to style captions."""
 
     # --- Font and Color ---
-    font_path: List[str] = field(default_factory=lambda: ["Fonts/font_1.ttf"])
-    color_palette: List[str] = field(default_factory=lambda: [
+    font_path: Tuple[str, ...] = ("Fonts/font_1.ttf",)
+    deterministic_font: bool = True  # Same video, same font (picked by hashing the video path)
+    color_palette: Tuple[str, ...] = (
         "#E74747", "#FF6B6B", "#4ECDC4", "#2AA0BB", "#36AF77",
         "#C565C5", "#58310B", "#6C5CE7", "#1C533F", "#BB394C"
-    ])
+    )
 
     # --- General Text Properties ---
     font_size: int = 80
@@ -48,6 +49,9 @@ class Config:
     zoom_end_scale: float = 1.0
     zoom_duration: float = 0.3
 
+    # --- Timing ---
+    min_word_duration: float = 0.04  # Shorter words get no caption frame of their own (~1 frame at 25fps)
+
     # --- Text Properties ---
     word_count: int = 4
     line_spacing: int = 10
@@ -68,9 +72,19 @@ class Config:
     reject_invalid_aspect: bool = False
     padding_color: Tuple[int, int, int] = (0, 0, 0)
 
+    # --- Decoding ---
+    target_resolution: Optional[Tuple[int, int]] = None  # (width, height) ffmpeg decodes to; None keeps the source size
+    need_audio: bool = True  # False decodes video only and copies the source audio in after rendering
+
+    # --- Performance ---
+    render_workers: int = 0  # Caption render processes; 0 = one per CPU core, 1 = in-process
+    use_stt_cache: bool = True  # Reuse transcriptions of identical videos (see constants.STT_CACHE_FOLDER)
+    use_ffmpeg_overlay: bool = False  # Burn captions in with ffmpeg's overlay filter (static captions, no animation)
+    overlay_codec: str = "libx264"  # Encoder for the ffmpeg overlay path, e.g. "h264_nvenc"
+
     # --- Output Path ---
-    word_timestamps: List[WordTimestamp] = field(default_factory=list)
-    output_path: str = f'{constants.OUTPUT_FOLDER}/{utils.generate_random_string()}.mp4'
+    word_timestamps: List[WordTimestamp] = field(default_factory=list, hash=False)
+    output_path: str = field(default_factory=lambda: f'{constants.OUTPUT_FOLDER}/{utils.generate_random_string()}.mp4')
 
     @staticmethod
     def from_json(json_path: str) -> "Config":
@@ -85,6 +99,12 @@ class Config:
         field_names = {f.name for f in fields(Config)}
         filtered_data = {k: v for k, v in json_data.items() if k in field_names}
 
+        # JSON arrays become tuples so the frozen config stays hashable
+        filtered_data = {
+            k: tuple(v) if isinstance(v, list) and k != "word_timestamps" else v
+            for k, v in filtered_data.items()
+        }
+
         # Merge filtered JSON data into defaults
         merged = {**default_values, **filtered_data}
 
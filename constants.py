@@ -1,4 +1,5 @@
 INPUT_FOLDER="./input"
 OUTPUT_FOLDER="./output"
 TEMP_OUTPUT="./tempOutput"
-FPS=30
\ No newline at end of file
+FPS=30
+STT_CACHE_FOLDER="~/.cache/capto"
\ No newline at end of file
@@ -0,0 +1,81 @@
+from typing import Dict, Iterable, Tuple
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+class GlyphAtlas:
+    """Every caption word pre-rendered (text + stroke) into one RGBA sheet."""
+
+    MAX_WIDTH = 2048
+    GUTTER = 1  # Keeps neighbouring words from bleeding into each other
+
+    def __init__(self, font: ImageFont.FreeTypeFont, stroke_width: int, stroke_color: str):
+        self.font = font
+        self.stroke_width = stroke_width
+        self.stroke_color = stroke_color
+        self.pixels = np.zeros((0, 0, 4), dtype=np.uint8)
+        # (word, color) -> (u, v, width, height, offset_x, offset_y)
+        self._uv: Dict[Tuple[str, str], Tuple[int, int, int, int, int, int]] = {}
+        self._extra: Dict[Tuple[str, str], Tuple[np.ndarray, int, int]] = {}
+
+    def __len__(self):
+        return len(self._uv) + len(self._extra)
+
+    def build(self, words: Iterable[str], colors: Iterable[str]) -> "GlyphAtlas":
+        """Rasterize each distinct (word, color) pair exactly once."""
+        entries = []
+        for word in dict.fromkeys(words):
+            left, top, right, bottom = self.font.getbbox(word, stroke_width=self.stroke_width)
+            width, height = max(1, right - left), max(1, bottom - top)
+            for color in dict.fromkeys(colors):
+                entries.append((word, color, width, height, left, top))
+
+        # Shelf packing: tallest first, left to right, new row on overflow
+        entries.sort(key=lambda entry: entry[3], reverse=True)
+        atlas_width = max([self.MAX_WIDTH] + [entry[2] + self.GUTTER for entry in entries])
+        u = v = shelf_height = 0
+        placed = []
+        for word, color, width, height, left, top in entries:
+            if u + width > atlas_width:
+                u, v = 0, v + shelf_height + self.GUTTER
+                shelf_height = 0
+            placed.append((word, color, u, v, width, height, left, top))
+            u += width + self.GUTTER
+            shelf_height = max(shelf_height, height)
+
+        sheet = Image.new("RGBA", (atlas_width, max(1, v + shelf_height)), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(sheet)
+        self._uv = {}
+        self._extra = {}
+        for word, color, u, v, width, height, left, top in placed:
+            draw.text(
+                (u - left, v - top), word, font=self.font, fill=color,
+                stroke_width=self.stroke_width, stroke_fill=self.stroke_color
+            )
+            self._uv[(word, color)] = (u, v, width, height, left, top)
+
+        self.pixels = np.asarray(sheet)
+        self.pixels.flags.writeable = False
+        return self
+
+    def tile(self, word: str, color: str) -> Tuple[np.ndarray, int, int]:
+        """
+        Return (rgba, offset_x, offset_y) for a word, where the offsets locate
+        the tile relative to the draw.text() origin. Unknown words are rendered
+        on demand and kept alongside the sheet.
+        """
+        uv = self._uv.get((word, color))
+        if uv is not None:
+            u, v, width, height, left, top = uv
+            return self.pixels[v:v + height, u:u + width], left, top
+
+        extra = self._extra.get((word, color))
+        if extra is None:
+            left, top, right, bottom = self.font.getbbox(word, stroke_width=self.stroke_width)
+            tile = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+            ImageDraw.Draw(tile).text(
+                (-left, -top), word, font=self.font, fill=color,
+                stroke_width=self.stroke_width, stroke_fill=self.stroke_color
+            )
+            extra = (np.asarray(tile), left, top)
+            self._extra[(word, color)] = extra
+        return extra
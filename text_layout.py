@@ -0,0 +1,57 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the kernel runs as plain Python without it
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+@njit(cache=True)
+def wrap_lines(widths, heights, caption_width, space_width, line_spacing):
+    """
+    Greedy word wrap over precomputed word metrics.
+
+    Returns flat arrays describing each line: index of its first word, pixel
+    width (without the trailing space), height, and y offset from the top.
+    """
+    n = len(widths)
+    line_starts = np.empty(n, dtype=np.int32)
+    line_widths = np.empty(n, dtype=np.float64)
+    line_heights = np.empty(n, dtype=np.int64)
+    line_ys = np.empty(n, dtype=np.int64)
+
+    count = 0
+    y = 0
+    line_start = 0
+    current_width = 0.0
+    max_height = 0
+
+    for k in range(n):
+        # Matches the original layout: the overflowing word's height counts toward the line it closes
+        max_height = max(max_height, heights[k])
+
+        if current_width + widths[k] > caption_width:
+            if k > line_start:
+                line_starts[count] = line_start
+                line_widths[count] = current_width - space_width
+                line_heights[count] = max_height
+                line_ys[count] = y
+                y += max_height + line_spacing
+                count += 1
+
+            line_start = k
+            current_width = 0.0
+            max_height = heights[k]
+
+        current_width += widths[k] + space_width
+
+    if n > line_start:
+        line_starts[count] = line_start
+        line_widths[count] = current_width - space_width
+        line_heights[count] = max_height
+        line_ys[count] = y
+        count += 1
+
+    return line_starts[:count], line_widths[:count], line_heights[:count], line_ys[:count]
@@ -1,4 +1,3 @@
-from pathlib import Path
 import subprocess
 import json
 import os
@@ -7,28 +6,19 @@ import string
 from custom_logger import logger_config
 import constants
 import secrets
+import hashlib
+import mmap
 import common
+import numpy as np
+from PIL import Image
 
-def list_files_recursive(directory):
-    file_list = []
+ALPHA_SCALE = np.float32(1 / 255)
 
-    for root, _, files in os.walk(directory):
-        for file in files:
-            # Get the full path
-            file_list.append(os.path.join(root, file))
-    
-    return file_list
+def list_files_recursive(directory):
+    return [entry.path for entry in common.scan_tree(directory) if not entry.is_dir()]
 
 def remove_file(file_path, retry=True):
-    try:
-        if os.path.exists(file_path):
-            Path(file_path).unlink()
-            logger_config.success(f"{file_path} has been removed successfully.")
-    except Exception as e:
-        logger_config.warning(f"Error occurred while trying to remove the file: {e}")
-        if retry:
-            logger_config.debug("retrying after 10 seconds", seconds=10)
-            remove_file(file_path, False)
+    common.remove_file(file_path, retry)
 
 def remove_directory(directory_path):
     try:
@@ -50,15 +40,56 @@ def generate_random_string(length=10):
     random_string = ''.join(secrets.choice(characters) for _ in range(length))
     return random_string
 
+def get_file_hash(file_path, window_size=16 * 1024 * 1024):
+    """SHA-256 of a file's contents without copying it through Python."""
+    with open(file_path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            # Python 3.11+: hashed in C with the GIL released
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+
+        digest = hashlib.sha256()
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, window_size):
+                    digest.update(view[offset:offset + window_size])
+            finally:
+                view.release()
+        return digest.hexdigest()
+
+def write_json_atomic(json_path, data):
+    """Write JSON via a temp file + rename so readers never see a partial file."""
+    tmp_path = f'{json_path}.{generate_random_string()}.tmp'
+    try:
+        create_directory(os.path.dirname(json_path))
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, json_path)
+    except Exception as e:
+        logger_config.warning(f"Failed to write {json_path}: {e}")
+        remove_file(tmp_path, retry=False)
+
 def write_videofile(video_clip, output_path, fps=constants.FPS):
+    from moviepy.config import get_setting
+
+    codec = common.get_h264_encoder(get_setting("FFMPEG_BINARY"))
+    if codec == 'h264_nvenc':
+        # Constant-quality VBR, roughly what libx264's default CRF gives
+        preset, codec_params = common.NVENC_PRESET, list(common.NVENC_PARAMS + common.NVENC_CONSTANT_QUALITY)
+    else:
+        preset, codec_params = 'veryfast', ['-pix_fmt', 'yuv420p']
+
     video_clip.write_videofile(
         output_path,
         fps=fps,
-        codec='libx264',
-        preset='veryfast',
+        codec=codec,
+        preset=preset,
         threads = common.get_threads(),
-        ffmpeg_params=[
-            '-pix_fmt', 'yuv420p',
+        ffmpeg_params=codec_params + [
             '-movflags', '+faststart',
         ],
         remove_temp=True,
@@ -69,6 +100,22 @@ def write_videofile(video_clip, output_path, fps=constants.FPS):
         # audio_codec='aac',
     )
 
+def mux_audio(video_path, audio_source_path, output_path):
+    """Combine the video stream of one file with the audio stream (if any) of another."""
+    cmd = [
+        'ffmpeg', '-y',
+        '-i', video_path,
+        '-i', audio_source_path,
+        '-map', '0:v:0',
+        '-map', '1:a:0?',
+        '-c:v', 'copy',
+        '-c:a', 'aac',
+        '-b:a', '192k',
+        '-movflags', '+faststart',
+        output_path
+    ]
+    return common.run_ffmpeg(cmd)
+
 def get_video_fps(video_path):
     """Get the actual display frame rate (tbr) from video."""
     try:
@@ -93,7 +140,7 @@ def get_video_fps(video_path):
         print(f"Error detecting FPS: {e}, using default 30")
         return 30
 
-def apply_zoom_animation(clip, start_scale=0.8, end_scale=1.0, duration=0.3):
+def zoom_scale_function(start_scale=0.8, end_scale=1.0, duration=0.3):
     def scale_function(t):
         if t < duration:
             progress = t / duration
@@ -101,8 +148,58 @@ def apply_zoom_animation(clip, start_scale=0.8, end_scale=1.0, duration=0.3):
             eased = 1 - (1 - progress) ** 3
             return start_scale + (end_scale - start_scale) * eased
         return end_scale
-    
-    return clip.resize(scale_function)
+
+    return scale_function
+
+def apply_zoom_animation(clip, start_scale=0.8, end_scale=1.0, duration=0.3):
+    return clip.resize(zoom_scale_function(start_scale, end_scale, duration))
+
+def apply_scale_table(clip, scale_function, fps=constants.FPS):
+    """
+    Animate the size of a static clip from a table of per-frame sizes.
+    Colour and mask are resampled together in one PIL call per distinct
+    size, instead of resize(lambda t: ...) calling back into Python and
+    resampling colour and mask separately on every frame.
+    """
+    count = max(1, int(np.ceil(clip.duration * fps)))
+    width, height = clip.size
+    sizes = []
+    for k in range(count):
+        scale = scale_function(k / fps)
+        sizes.append((max(1, int(width * scale)), max(1, int(height * scale))))
+
+    rgb = clip.get_frame(0).astype(np.uint8)
+    if clip.mask is not None:
+        alpha = (255 * clip.mask.get_frame(0)).astype(np.uint8)
+    else:
+        alpha = np.full(rgb.shape[:2], 255, dtype=np.uint8)
+    source = Image.fromarray(np.dstack([rgb, alpha]), "RGBA")
+
+    # Colour and mask ask for the same time in turn; keep just that frame
+    current = {}
+    def frame_at(t):
+        size = sizes[min(int(t * fps + 1e-6), count - 1)]
+        if size not in current:
+            current.clear()
+            resized = source if size == source.size else source.resize(size, Image.LANCZOS)
+            current[size] = np.asarray(resized)
+        return current[size]
+
+    scaled = clip.fl(lambda gf, t: frame_at(t)[:, :, :3])
+    mask_source = clip.mask if clip.mask is not None else scaled.to_mask()
+    mask = mask_source.fl(lambda gf, t: frame_at(t)[:, :, 3].astype(np.float32) * ALPHA_SCALE)
+    return scaled.set_mask(mask)
+
+def rgba_image_clip(rgba):
+    """
+    ImageClip from an RGBA array with a float32 mask. MoviePy's own RGBA
+    handling builds a float64 mask, which doubles the bytes its alpha blend
+    reads and writes for every caption pixel on every frame.
+    """
+    from moviepy.editor import ImageClip
+
+    mask = ImageClip(rgba[:, :, 3].astype(np.float32) * ALPHA_SCALE, ismask=True)
+    return ImageClip(rgba[:, :, :3]).set_mask(mask)
 
 def check_if_vfr(video_path):
     try: